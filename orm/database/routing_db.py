@@ -0,0 +1,180 @@
+"""
+Routing DBs- ORMDB implementations that wrap several other ORMDBs,
+sending writes to a primary and reads to replicas, and/or sharding
+tables across engines by hashing the primary key.
+"""
+import itertools
+import re
+import threading
+import zlib
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Sequence
+
+import rshanker779_common as utils
+
+from orm.database.orm_db import ORMDB
+from orm.database.simple_db import _SQLParser, SQLType
+from orm.exceptions import RoutingError
+
+logger = utils.get_logger(__name__)
+
+_transaction_statements = {"begin", "commit"}
+_foreign_key_regex = re.compile(
+    r",\s*foreign key\s*\([^)]*\)\s*references\s+\w+\s*\([^)]*\)", re.IGNORECASE
+)
+
+
+def _get_statements(sql_str: str) -> List[str]:
+    statements = (i.strip() for i in sql_str.strip().lower().split(";"))
+    return [i for i in statements if i and i not in _transaction_statements]
+
+
+def is_read_query(sql_str: str) -> bool:
+    statements = _get_statements(sql_str)
+    return bool(statements) and all(i.startswith("select") for i in statements)
+
+
+class ReadStrategy(Enum):
+    ROUND_ROBIN = 0
+    LEAST_LOADED = 1
+
+
+class ReplicatedORMDB(utils.StringMixin, ORMDB):
+    """
+    Sends writes to the primary and spreads reads across the replicas.
+    If replicate_writes is set, writes are also applied to every replica,
+    which stands in for real replication when the replicas are simple DBs
+    """
+
+    def __init__(
+        self,
+        primary: ORMDB,
+        replicas: Sequence[ORMDB] = (),
+        read_strategy: ReadStrategy = ReadStrategy.ROUND_ROBIN,
+        replicate_writes: bool = False,
+    ):
+        super().__init__()
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.read_strategy = read_strategy
+        self.replicate_writes = replicate_writes
+        self._round_robin = itertools.cycle(range(len(self.replicas)))
+        self._in_flight = [0] * len(self.replicas)
+        self._reads_served = [0] * len(self.replicas)
+        self._lock = threading.Lock()
+
+    def parse_sql(self, sql_str):
+        if not self.replicas or not is_read_query(sql_str):
+            return self._write(sql_str)
+        with self._lock:
+            replica_index = self._choose_replica()
+            self._in_flight[replica_index] += 1
+            self._reads_served[replica_index] += 1
+        try:
+            logger.info(f"Routing read to replica {replica_index}")
+            return self.replicas[replica_index].parse_sql(sql_str)
+        finally:
+            with self._lock:
+                self._in_flight[replica_index] -= 1
+
+    def _write(self, sql_str):
+        result = self.primary.parse_sql(sql_str)
+        if self.replicate_writes:
+            for replica in self.replicas:
+                replica.parse_sql(sql_str)
+        return result
+
+    def _choose_replica(self) -> int:
+        if self.read_strategy == ReadStrategy.LEAST_LOADED:
+            # Ties on in-flight queries are broken by total reads served,
+            # so a serial workload is still spread evenly
+            return min(
+                range(len(self.replicas)),
+                key=lambda i: (self._in_flight[i], self._reads_served[i]),
+            )
+        return next(self._round_robin)
+
+
+class ShardedORMDB(utils.StringMixin, ORMDB):
+    """
+    Shards each table across several ORMDBs by hashing its primary key.
+    Table creation goes to every shard, inserts go to the owning shard, and
+    selects go to the owning shard when filtered on the full primary key,
+    otherwise they fan out to every shard and the results are merged.
+    Related rows usually live on different shards, so foreign keys are
+    stripped from the table creation sent to each shard
+    """
+
+    def __init__(
+        self,
+        shards: Sequence[ORMDB],
+        get_primary_keys: Callable[[], Dict[str, List[str]]] = dict,
+    ):
+        super().__init__()
+        if not shards:
+            raise RoutingError("At least one shard is required")
+        self.shards = list(shards)
+        self.sql_parser = _SQLParser()
+        self.get_primary_keys = get_primary_keys
+
+    def parse_sql(self, sql_str):
+        statements = _get_statements(sql_str)
+        if any(i.startswith("create") for i in statements):
+            return self._create_tables(sql_str)
+        sql_return = self.sql_parser._parse_sql(sql_str)
+        if sql_return is None:
+            return self._fan_out(sql_str)
+        table_name = sql_return.table_name
+        if sql_return.type == SQLType.INSERT:
+            row_values = {
+                i.strip(): getattr(sql_return.row, i) for i in sql_return.row.col_names
+            }
+            primary_keys = self._get_primary_keys(table_name)
+            if primary_keys is None:
+                raise RoutingError(
+                    f"No primary key known for table {table_name}, cannot shard"
+                )
+            shard = self._get_shard(table_name, primary_keys, row_values)
+            return shard.parse_sql(sql_str)
+        if sql_return.type == SQLType.SELECT:
+            filter_values = {
+                col.strip(): val.strip() for col, val in sql_return.filters
+            }
+            primary_keys = self._get_primary_keys(table_name)
+            is_keyed = primary_keys is not None and all(
+                i in filter_values for i in primary_keys
+            )
+            if is_keyed:
+                shard = self._get_shard(table_name, primary_keys, filter_values)
+                return shard.parse_sql(sql_str)
+        return self._fan_out(sql_str)
+
+    def _create_tables(self, sql_str: str):
+        shard_sql = _foreign_key_regex.sub("", sql_str)
+        for shard in self.shards:
+            shard.parse_sql(shard_sql)
+
+    def _fan_out(self, sql_str):
+        logger.info(f"Fanning out query to {len(self.shards)} shards")
+        results = [shard.parse_sql(sql_str) for shard in self.shards]
+        if all(i is None for i in results):
+            return None
+        return [row for result in results if result is not None for row in result]
+
+    def _get_primary_keys(self, table_name: str) -> Optional[List[str]]:
+        # The parser lowercases the sql, so match on lowercased names
+        primary_keys = {
+            i.lower(): [col_name.lower() for col_name in v]
+            for i, v in self.get_primary_keys().items()
+        }
+        return primary_keys.get(table_name.strip())
+
+    def _get_shard(
+        self, table_name: str, primary_keys: List[str], values: Dict[str, str]
+    ) -> ORMDB:
+        key = "\x1f".join(
+            values[i].replace("'", "").replace('"', "") for i in primary_keys
+        )
+        shard_index = zlib.crc32(key.encode()) % len(self.shards)
+        logger.info(f"Routing {table_name} key {key} to shard {shard_index}")
+        return self.shards[shard_index]
@@ -0,0 +1,257 @@
+"""
+Shared DB- A simple DB whose table storage lives in shared memory, so
+several processes can hold one copy of a dataset. A catalog segment
+records each table's columns and the segment holding its rows; other
+processes attach to the catalog by name rather than re-running the SQL
+that built it. Writers hold an exclusive file lock and catalog reads a
+shared one, and segments are only removed by an explicit call to unlink
+"""
+import contextlib
+import fcntl
+import json
+import os
+import struct
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterator, Iterable, Dict, Any
+
+import rshanker779_common as utils
+
+from orm.database.simple_db import (
+    Column,
+    DB,
+    IncorrectColumnError,
+    Row,
+    Table,
+    _SQLParser,
+)
+
+logger = utils.get_logger(__name__)
+
+# Catalog and table segments both start with two counters: the catalog
+# stores (version, payload length), a table stores (row count, bytes used)
+_header = struct.Struct("<QQ")
+_row_length = struct.Struct("<I")
+_catalog_size = 1 << 16
+_default_table_size = 1 << 16
+_type_names = {v: i for i, v in _SQLParser._column_type_map.items()}
+
+
+class ReadOnlyError(Exception):
+    pass
+
+
+def _create_segment(name: str, size: int) -> shared_memory.SharedMemory:
+    segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+    # Lifetime is managed by SharedDB.unlink, not by whichever process exits first
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def _attach_segment(name: str) -> shared_memory.SharedMemory:
+    segment = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def _unlink_segment(segment: shared_memory.SharedMemory):
+    # SharedMemory.unlink unregisters the segment from the tracker itself
+    resource_tracker.register(segment._name, "shared_memory")
+    segment.unlink()
+
+
+class SharedTable(utils.StringMixin):
+    def __init__(
+        self,
+        table_name: str,
+        columns: Iterable[Column],
+        db: "SharedDB",
+        segment: shared_memory.SharedMemory,
+    ):
+        super().__init__()
+        self.name = table_name
+        self.columns = columns
+        self.col_names = {i.name for i in columns}
+        self.db = db
+        self.segment = segment
+
+    @property
+    def rows(self) -> Iterator[Row]:
+        segment = self.segment
+        col_order = [i.name for i in self.columns]
+        _, used = _header.unpack_from(segment.buf)
+        position = _header.size
+        while position < _header.size + used:
+            (length,) = _row_length.unpack_from(segment.buf, position)
+            position += _row_length.size
+            values = json.loads(bytes(segment.buf[position : position + length]))
+            position += length
+            yield Row(dict(zip(col_order, values)))
+
+    def add_row(self, row: Row):
+        if {i.strip() for i in row.col_names} != self.col_names:
+            raise IncorrectColumnError(
+                f"Row names {row.col_names} do not match columns {self.col_names}"
+            )
+        values = {i.strip(): getattr(row, i) for i in row.col_names}
+        self.db._append_row(self.name, [values[i.name] for i in self.columns])
+
+
+class SharedDB(DB):
+    def __init__(
+        self, name: str, read_only: bool = False, table_size: int = _default_table_size,
+    ):
+        super().__init__()
+        self.name = name
+        self.read_only = read_only
+        self.table_size = table_size
+        self.tables = {}  # type: Dict[str, SharedTable]
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"orm_shared_{name}.lock")
+        self._catalog_data = {"next_segment": 0, "tables": {}}
+        self._catalog_version = None
+        if read_only:
+            # Attach before locking, so a missing db leaves no lock file behind.
+            # The catalog is created under the write lock, so is loaded under it
+            self._catalog = _attach_segment(f"{name}_catalog")
+            logger.info(f"Attached read only to shared db {name}")
+            self._refresh()
+            return
+        with self._write_lock():
+            try:
+                self._catalog = _attach_segment(f"{name}_catalog")
+                logger.info(f"Attached to shared db {name}")
+            except FileNotFoundError:
+                logger.info(f"Creating shared db {name}")
+                self._catalog = _create_segment(f"{name}_catalog", _catalog_size)
+                self._write_catalog()
+            self._load_catalog()
+
+    @contextlib.contextmanager
+    def _lock(self, operation: int):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_lock(self):
+        return self._lock(fcntl.LOCK_EX)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ReadOnlyError(f"Shared db {self.name} is attached read only")
+
+    def _write_catalog(self):
+        payload = json.dumps(self._catalog_data).encode()
+        if _header.size + len(payload) > self._catalog.size:
+            raise ValueError(f"Catalog for shared db {self.name} is full")
+        version = 0 if self._catalog_version is None else self._catalog_version + 1
+        buf = self._catalog.buf
+        buf[_header.size : _header.size + len(payload)] = payload
+        _header.pack_into(buf, 0, version, len(payload))
+        self._catalog_version = version
+
+    def _refresh(self):
+        # Writers rewrite the catalog and unlink replaced segments, so hold
+        # the lock while reading it and attaching the segments it names
+        with self._lock(fcntl.LOCK_SH):
+            self._load_catalog()
+
+    def _load_catalog(self):
+        version, length = _header.unpack_from(self._catalog.buf)
+        if version == self._catalog_version:
+            return
+        payload = bytes(self._catalog.buf[_header.size : _header.size + length])
+        self._catalog_data = json.loads(payload)
+        self._catalog_version = version
+        tables = {}
+        for table_name, table_data in self._catalog_data["tables"].items():
+            existing = self.tables.get(table_name)
+            if existing is not None and existing.segment.name == table_data["segment"]:
+                tables[table_name] = existing
+                continue
+            columns = [
+                Column(i, _SQLParser._column_type_map[v])
+                for i, v in table_data["columns"]
+            ]
+            segment = _attach_segment(table_data["segment"])
+            tables[table_name] = SharedTable(table_name, columns, self, segment)
+        self.tables = tables
+
+    def _new_segment_name(self, table_name: str) -> str:
+        segment_number = self._catalog_data["next_segment"]
+        self._catalog_data["next_segment"] += 1
+        return f"{self.name}_{table_name}_{segment_number}"
+
+    def _add_table(self, table: Table):
+        self._check_writable()
+        logger.info(f"Adding shared table {table.name}")
+        with self._write_lock():
+            self._load_catalog()
+            existing = self.tables.get(table.name)
+            if existing is not None:
+                _unlink_segment(existing.segment)
+            segment = _create_segment(
+                self._new_segment_name(table.name), self.table_size
+            )
+            _header.pack_into(segment.buf, 0, 0, 0)
+            self._catalog_data["tables"][table.name] = {
+                "columns": [[i.name, _type_names[i.data_type]] for i in table.columns],
+                "segment": segment.name,
+            }
+            self._write_catalog()
+            self.tables[table.name] = SharedTable(
+                table.name, table.columns, self, segment
+            )
+
+    def _append_row(self, table_name: str, values: Iterable[Any]):
+        self._check_writable()
+        data = json.dumps(values).encode()
+        with self._write_lock():
+            self._load_catalog()
+            table = self.tables[table_name]
+            row_count, used = _header.unpack_from(table.segment.buf)
+            required = _header.size + used + _row_length.size + len(data)
+            if required > table.segment.size:
+                self._grow_table(table, max(2 * table.segment.size, required))
+            buf = table.segment.buf
+            position = _header.size + used
+            _row_length.pack_into(buf, position, len(data))
+            position += _row_length.size
+            buf[position : position + len(data)] = data
+            # Rows are read without the lock, so write the header last
+            _header.pack_into(
+                buf, 0, row_count + 1, used + _row_length.size + len(data)
+            )
+
+    def _grow_table(self, table: SharedTable, size: int):
+        logger.info(f"Growing shared table {table.name} to {size} bytes")
+        old_segment = table.segment
+        _, used = _header.unpack_from(old_segment.buf)
+        segment = _create_segment(self._new_segment_name(table.name), size)
+        segment.buf[: _header.size + used] = old_segment.buf[: _header.size + used]
+        self._catalog_data["tables"][table.name]["segment"] = segment.name
+        self._write_catalog()
+        table.segment = segment
+        # Processes still attached keep their mapping until they refresh
+        _unlink_segment(old_segment)
+
+    def get_table(self, table_name: str) -> SharedTable:
+        self._refresh()
+        return super().get_table(table_name)
+
+    def close(self):
+        for table in self.tables.values():
+            table.segment.close()
+        self._catalog.close()
+
+    def unlink(self):
+        with self._write_lock():
+            self._load_catalog()
+            for table in self.tables.values():
+                _unlink_segment(table.segment)
+            _unlink_segment(self._catalog)
+        self.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._lock_path)
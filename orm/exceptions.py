@@ -1,2 +1,6 @@
 class InvalidTypeData(Exception):
     pass
+
+
+class RoutingError(Exception):
+    pass
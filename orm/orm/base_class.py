@@ -1,12 +1,14 @@
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Sequence, Union
 
 import rshanker779_common as utils
 
 from orm.data_structures.column import Column
 from orm.data_structures.table_information import TableInformation
+from orm.database.orm_db import ORMDB
 from orm.database.postgres_db import PostgresORMDB
+from orm.database.routing_db import ReplicatedORMDB, ShardedORMDB, ReadStrategy
 from orm.database.simple_db import DB
-from orm.exceptions import InvalidTypeData
+from orm.exceptions import InvalidTypeData, RoutingError
 from orm.orm.query_builder import QueryBuilder
 from orm.orm.table_creator import TableCreator
 from orm.orm.table_information_builder import TableInformationBuilder
@@ -14,6 +16,50 @@ from orm.orm.table_information_builder import TableInformationBuilder
 logger = utils.get_logger(__name__)
 
 
+class ReplicaSet(utils.StringMixin):
+    """
+    Routing configuration for a primary engine with read replicas
+    """
+
+    def __init__(
+        self,
+        primary: str,
+        replicas: Sequence[str] = (),
+        read_strategy: ReadStrategy = ReadStrategy.ROUND_ROBIN,
+    ):
+        super().__init__()
+        self.primary = primary
+        self.replicas = replicas
+        self.read_strategy = read_strategy
+
+    @property
+    def is_private(self) -> bool:
+        """
+        Whether the engines are private simple dbs, which do not replicate
+        themselves. Raises if private and shared or postgres engines are mixed
+        """
+        engines = [self.primary, *self.replicas]
+        private_engines = [
+            not i.startswith("shared://") and "postgresql" not in i for i in engines
+        ]
+        if len(set(private_engines)) > 1:
+            raise RoutingError(
+                f"Replica set {engines} mixes private simple dbs with shared "
+                f"or postgres dbs, so replicas cannot be kept in sync"
+            )
+        return private_engines[0]
+
+
+class ShardSet(utils.StringMixin):
+    """
+    Routing configuration for tables sharded by primary key across engines
+    """
+
+    def __init__(self, shards: Sequence[Union[str, ReplicaSet]]):
+        super().__init__()
+        self.shards = shards
+
+
 class BaseMeta(type):
     known_tables: Dict[str, TableInformation] = {}
 
@@ -63,21 +109,60 @@ class Base(utils.StringMixin, metaclass=BaseMeta):
                 setattr(self, col_name, res)
 
     @classmethod
-    def build(cls, engine_str: str):
+    def build(cls, engine_str: Union[str, ReplicaSet, ShardSet]):
         cls.engine_str = engine_str
-        if "postgresql" in engine_str:
+        cls.db = cls._build_db(engine_str)
+        return cls
+
+    @classmethod
+    def _build_db(
+        cls, engine_str: Union[str, ReplicaSet, ShardSet], is_replica=False
+    ) -> ORMDB:
+        if isinstance(engine_str, ShardSet):
+            logger.info(f"Using {len(engine_str.shards)} shards")
+            return ShardedORMDB(
+                [cls._build_db(i) for i in engine_str.shards], cls.get_primary_keys
+            )
+        elif isinstance(engine_str, ReplicaSet):
+            logger.info(f"Using {len(engine_str.replicas)} replicas")
+            replicate_writes = engine_str.is_private
+            return ReplicatedORMDB(
+                cls._build_db(engine_str.primary),
+                [cls._build_db(i, is_replica=True) for i in engine_str.replicas],
+                engine_str.read_strategy,
+                replicate_writes=replicate_writes,
+            )
+        elif engine_str.startswith("shared://"):
+            logger.info("Using shared memory simple db")
+            # Imported here as shared memory needs python 3.8 and fcntl is POSIX only
+            from orm.database.shared_db import SharedDB
+
+            name, _, options = engine_str[len("shared://") :].partition("?")
+            return SharedDB(name, read_only=is_replica or options == "read_only")
+        elif "postgresql" in engine_str:
             logger.info("Using postgres db")
-            cls.db = PostgresORMDB()
+            conn_string = engine_str if "://" in engine_str else None
+            return PostgresORMDB(conn_string, drop_tables=not is_replica)
         else:
             logger.info("Using simple db")
-            cls.db = DB()
-        return cls
+            return DB()
 
     @classmethod
     def get_columns(cls, class_dict=None) -> List[Tuple[str, Column]]:
         class_dict = cls.__dict__ if class_dict is None else class_dict
         return [(i, v) for i, v in class_dict.items() if isinstance(v, Column)]
 
+    @classmethod
+    def get_primary_keys(cls) -> Dict[str, List[str]]:
+        return {
+            table_information.table_name: [
+                col_name
+                for col_name, column in table_information.columns
+                if column.primary_key
+            ]
+            for table_information in cls.known_tables.values()
+        }
+
     @classmethod
     def create_all_tables(cls):
         table_name_map = {
@@ -0,0 +1,165 @@
+import threading
+
+import pytest
+
+from orm import ReplicaSet, ShardSet
+from orm.database.routing_db import ReplicatedORMDB, ShardedORMDB, ReadStrategy
+from orm.database.simple_db import DB
+from orm.exceptions import RoutingError
+from tests.conftest import build_base, MyBase, User
+
+create_sql = "create table users ( id Int,name Varchar,PRIMARY KEY (id) );"
+
+
+def get_primary_keys():
+    return {"users": ["id"]}
+
+
+def insert_sql(user_id, name):
+    return f"insert into users (id,name) values ('{user_id}','{name}');"
+
+
+@pytest.mark.parametrize(
+    "read_strategy", [ReadStrategy.ROUND_ROBIN, ReadStrategy.LEAST_LOADED]
+)
+def test_replicated_db_spreads_reads(read_strategy):
+    replicas = [DB(), DB()]
+    db = ReplicatedORMDB(DB(), replicas, read_strategy, replicate_writes=True)
+    db.parse_sql(create_sql)
+    db.parse_sql(insert_sql(1, "a"))
+    assert len(db.primary.get_table("users").rows) == 1
+    for _ in range(4):
+        assert db.parse_sql("select id,name from users;") == [("1", "a")]
+    assert db._reads_served == [2, 2]
+
+
+class BlockingDB(DB):
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def parse_sql(self, sql_str):
+        self.entered.set()
+        self.release.wait(timeout=10)
+        return super().parse_sql(sql_str)
+
+
+def test_replicated_db_avoids_busy_replica():
+    busy_replica = BlockingDB()
+    busy_replica.release.set()
+    db = ReplicatedORMDB(
+        DB(), [busy_replica, DB()], ReadStrategy.LEAST_LOADED, replicate_writes=True
+    )
+    db.parse_sql(create_sql)
+    busy_replica.release.clear()
+    busy_read = threading.Thread(target=db.parse_sql, args=("select id from users;",))
+    busy_read.start()
+    assert busy_replica.entered.wait(timeout=10)
+    for _ in range(3):
+        db.parse_sql("select id from users;")
+    assert db._in_flight == [1, 0]
+    assert db._reads_served == [1, 3]
+    busy_replica.release.set()
+    busy_read.join()
+    assert db._in_flight == [0, 0]
+
+
+def test_replicated_db_writes_only_to_primary():
+    db = ReplicatedORMDB(DB(), [DB()])
+    db.parse_sql(create_sql)
+    assert "users" in db.primary.tables
+    assert not db.replicas[0].tables
+
+
+def test_sharded_db_routes_by_primary_key():
+    db = ShardedORMDB([DB(), DB(), DB()], get_primary_keys)
+    db.parse_sql(create_sql)
+    for i in range(30):
+        db.parse_sql(insert_sql(i, "a"))
+    shard_sizes = [len(shard.get_table("users").rows) for shard in db.shards]
+    assert sum(shard_sizes) == 30
+    assert all(shard_sizes)
+    assert db.parse_sql("select id,name from users where id='7';") == [("7", "a")]
+    assert len(db.parse_sql("select id from users where name='a';")) == 30
+    assert len(db.parse_sql("select id from users;")) == 30
+
+
+def test_sharded_db_unknown_table():
+    db = ShardedORMDB([DB(), DB()])
+    db.parse_sql(create_sql)
+    assert db.parse_sql("select id from users where id='1';") == []
+    with pytest.raises(RoutingError):
+        db.parse_sql(insert_sql(1, "a"))
+
+
+class CountingDB(DB):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def parse_sql(self, sql_str):
+        self.queries.append(sql_str)
+        return super().parse_sql(sql_str)
+
+
+def test_sharded_db_mixed_case_primary_key():
+    db = ShardedORMDB([CountingDB(), CountingDB()], lambda: {"Accounts": ["accountId"]})
+    db.parse_sql("create table accounts ( accountId Int,name Varchar );")
+    for i in range(10):
+        db.parse_sql(f"insert into accounts (accountId,name) values ('{i}','a');")
+    query = "select accountId from accounts where accountId='3';"
+    assert db.parse_sql(query) == [("3",)]
+    assert sum(query in shard.queries for shard in db.shards) == 1
+
+
+class RecordingDB(DB):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def parse_sql(self, sql_str):
+        self.queries.append(sql_str)
+
+
+def test_sharded_db_strips_foreign_keys():
+    db = ShardedORMDB([RecordingDB(), RecordingDB()], get_primary_keys)
+    db.parse_sql(
+        "begin;create table posts ( id Int,user_id Int,PRIMARY KEY (id) "
+        ",FOREIGN KEY (user_id) REFERENCES users (id));commit;"
+    )
+    for shard in db.shards:
+        assert shard.queries == [
+            "begin;create table posts ( id Int,user_id Int,PRIMARY KEY (id) );commit;"
+        ]
+
+
+@pytest.mark.parametrize(
+    "engine",
+    [
+        ReplicaSet("simple", ["shared://orm_replica"]),
+        ReplicaSet("shared://orm_primary", ["simple"]),
+        ShardSet(["simple", ReplicaSet("postgresql", ["simple"])]),
+    ],
+)
+def test_mixed_replica_set(engine):
+    with pytest.raises(RoutingError):
+        build_base(engine)
+
+
+@pytest.mark.parametrize(
+    "engine",
+    [
+        ReplicaSet("simple", ["simple", "simple"]),
+        ShardSet(["simple", "simple", ReplicaSet("simple", ["simple"])]),
+    ],
+)
+def test_routed_base(engine):
+    build_base(engine)
+    MyBase.create_all_tables()
+    for i in range(5):
+        User(id=i, name="a").save()
+    User(id=5, name="b").save()
+    assert len(User.query().filter_by(name="a")) == 5
+    assert len(User.query().filter_by(id=5)) == 1
+    assert len(User.query().all()) == 6
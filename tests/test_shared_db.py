@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import uuid
+
+import pytest
+
+from orm.database.shared_db import SharedDB, ReadOnlyError
+from tests.conftest import build_base, MyBase, User
+
+create_sql = "create table users ( id Int,name Varchar,PRIMARY KEY (id) );"
+select_sql = "select id,name from users where name='b';"
+
+
+def insert_sql(user_id, name):
+    return f"insert into users (id,name) values ('{user_id}','{name}');"
+
+
+@pytest.fixture
+def shared_db():
+    db = SharedDB(f"orm{uuid.uuid4().hex[:8]}", table_size=256)
+    yield db
+    db.unlink()
+
+
+def read_in_child(name, queue):
+    db = SharedDB(name, read_only=True)
+    queue.put(db.parse_sql(select_sql))
+    db.close()
+
+
+def test_attached_db_sees_writes(shared_db):
+    shared_db.parse_sql(create_sql)
+    reader = SharedDB(shared_db.name, read_only=True)
+    assert reader.parse_sql(select_sql) == []
+    # Enough rows to grow the table past its initial segment
+    for i in range(50):
+        shared_db.parse_sql(insert_sql(i, "a" if i % 2 else "b"))
+    assert len(reader.parse_sql(select_sql)) == 25
+    assert len(reader.parse_sql("select id from users;")) == 50
+    with pytest.raises(ReadOnlyError):
+        reader.parse_sql(insert_sql(50, "a"))
+    reader.close()
+
+
+def test_child_process_attaches(shared_db):
+    shared_db.parse_sql(create_sql)
+    shared_db.parse_sql(insert_sql(1, "b"))
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=read_in_child, args=(shared_db.name, queue))
+    process.start()
+    assert queue.get(timeout=10) == [("1", "b")]
+    process.join()
+
+
+def test_read_only_db_must_exist():
+    with pytest.raises(FileNotFoundError):
+        SharedDB(f"orm{uuid.uuid4().hex[:8]}", read_only=True)
+
+
+def test_unlink_removes_lock_file():
+    db = SharedDB(f"orm{uuid.uuid4().hex[:8]}")
+    assert os.path.basename(db._lock_path).startswith("orm_shared_")
+    assert os.path.exists(db._lock_path)
+    db.unlink()
+    assert not os.path.exists(db._lock_path)
+
+
+def test_shared_base(shared_db):
+    build_base(f"shared://{shared_db.name}")
+    MyBase.create_all_tables()
+    User(id=1, name="a").save()
+    build_base(f"shared://{shared_db.name}?read_only")
+    try:
+        assert len(User.query().filter_by(name="a")) == 1
+    finally:
+        MyBase.db.close()